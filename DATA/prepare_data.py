@@ -1,34 +1,64 @@
 """
 prepare Dataset using EfficientNet Model with validation and testing dataset from IMAGENET
+
+Inference backend can be selected with --backend (eager, torchscript, compile, onnx,
+dynamic_int8, static_int8) and --channels-last. Use --benchmark N to compare all backends
+on N sample images: throughput and output logits difference against eager baseline.
+dynamic_int8 quantizes only Linear layers - in EfficientNet B3 just the classifier head,
+convolutions stay float32.
+
+With --thumbnails DIR dashboard thumbnails are made in the same pass, from the same
+decoded image, so transform_images.py doesn't have to decode all images again.
 """
 
+import argparse
+import copy
 import os
 import json
+import time
+import numpy as np
 import torch
 from torchvision import models, transforms
 from torchvision.models import EfficientNet_B3_Weights
 from PIL import Image
 from tqdm import tqdm
 
+try:
+    from DATA.transform_images import pad_image
+except ModuleNotFoundError:  # run as a script from DATA directory
+    from transform_images import pad_image
+
 
 IMAGE_DIR = os.path.join(os.path.dirname(__file__), "raw_images")
 OUTPUT = os.path.join(os.path.dirname(__file__), "output.json")
+ONNX_MODEL = os.path.join(os.path.dirname(__file__), "efficientnet_b3.onnx")
+BACKENDS = ("eager", "torchscript", "compile", "onnx", "dynamic_int8", "static_int8")
+EXAMPLE_INPUT_BACKENDS = ("torchscript", "onnx", "static_int8")
 
 
-def process_image(image_path, preprocess, model):
+def process_image(
+    image_path, preprocess, model, thumbnail_dir=None, thumbnail_size=(150, 150)
+):
     """
     preproces the image
 
     Args:
         image_path (str): path-like object to input image
         preprocess (torchvision.transforms.Compose): a set of rules for transforming the input image
-        model (torchvision.models): pretrained model for image classification
+        model (callable): pretrained model for image classification or inference backend built by build_backend
+        thumbnail_dir (str): directory to save padded thumbnail of the image to, None to skip
+        thumbnail_size (tuple): size of the thumbnail
 
     Returns:
         list: the image classification vector
     """
-    img = Image.open(image_path).convert("RGB")
-    img_tensor = preprocess(img).unsqueeze(0).to("cpu")
+    with Image.open(image_path) as img:
+        img.load()
+        if thumbnail_dir is not None:
+            pad_image(img, thumbnail_size).save(
+                os.path.join(thumbnail_dir, os.path.basename(image_path))
+            )
+        img_tensor = preprocess(img.convert("RGB")).unsqueeze(0).to("cpu")
 
     with torch.no_grad():
         output = model(img_tensor)
@@ -36,11 +66,13 @@ def process_image(image_path, preprocess, model):
     return output.squeeze().tolist()
 
 
-def main():
+def load_model():
     """
-    Do all processing.
+    Load pretrained EfficientNet B3 model and preprocessing for it.
+
+    Returns:
+        tuple: model in eval mode and torchvision.transforms.Compose preprocessing
     """
-    # LOAD MODEL
     weights = EfficientNet_B3_Weights.IMAGENET1K_V1
     model = models.efficientnet_b3(weights=weights)
     model.eval()
@@ -57,8 +89,200 @@ def main():
             ),
         ]
     )
+    return model, preprocess
 
-    result_dir = {}
+
+def build_backend(model, backend, example_inputs, channels_last=False):
+    """
+    Build inference backend from the eager model.
+
+    Args:
+        model (torch.nn.Module): eager model in eval mode
+        backend (str): one of BACKENDS
+        example_inputs (torch.Tensor): batch of preprocessed images, used for tracing, export and calibration;
+            needed only by EXAMPLE_INPUT_BACKENDS
+        channels_last (bool): use channels last memory format (torch backends only)
+
+    Returns:
+        callable: function taking batch of preprocessed images and returning logits tensor
+    """
+    if channels_last:
+        model = copy.deepcopy(model).to(memory_format=torch.channels_last)
+        if example_inputs is not None:
+            example_inputs = example_inputs.contiguous(
+                memory_format=torch.channels_last
+            )
+
+    with torch.no_grad():
+        if backend == "eager":
+            compiled = model
+        elif backend == "torchscript":
+            compiled = torch.jit.optimize_for_inference(
+                torch.jit.trace(model, example_inputs)
+            )
+        elif backend == "compile":
+            compiled = torch.compile(model)
+        elif backend == "dynamic_int8":
+            # only Linear layers are quantized, in EfficientNet it is the classifier head
+            compiled = torch.ao.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        elif backend in ("onnx", "static_int8"):
+            return build_onnx_backend(model, backend, example_inputs)
+        else:
+            raise ValueError(f"Unknown backend '{backend}', use one of {BACKENDS}")
+
+    if not channels_last:
+        return compiled
+    return lambda img_tensor: compiled(
+        img_tensor.contiguous(memory_format=torch.channels_last)
+    )
+
+
+def build_onnx_backend(model, backend, example_inputs):
+    """
+    Export the model to ONNX and run it with ONNX Runtime. For static_int8 the exported
+    model is quantized with calibration on example_inputs.
+
+    Args:
+        model (torch.nn.Module): eager model in eval mode
+        backend (str): 'onnx' or 'static_int8'
+        example_inputs (torch.Tensor): batch of preprocessed images
+
+    Returns:
+        callable: function taking batch of preprocessed images and returning logits tensor
+    """
+    import onnxruntime
+    from onnxruntime import quantization
+
+    torch.onnx.export(
+        model,
+        (example_inputs[:1].contiguous(),),
+        ONNX_MODEL,
+        input_names=["input"],
+        output_names=["output"],
+        dynamic_axes={"input": {0: "batch"}, "output": {0: "batch"}},
+        dynamo=False,
+    )
+    model_path = ONNX_MODEL
+
+    if backend == "static_int8":
+
+        class CalibrationReader(quantization.CalibrationDataReader):
+            def __init__(self):
+                self.inputs = iter(
+                    {"input": img_tensor.unsqueeze(0).numpy()}
+                    for img_tensor in example_inputs.contiguous()
+                )
+
+            def get_next(self):
+                return next(self.inputs, None)
+
+        model_path = ONNX_MODEL.replace(".onnx", "_int8.onnx")
+        quantization.quantize_static(ONNX_MODEL, model_path, CalibrationReader())
+
+    session = onnxruntime.InferenceSession(
+        model_path, providers=["CPUExecutionProvider"]
+    )
+    return lambda img_tensor: torch.from_numpy(
+        session.run(None, {"input": img_tensor.contiguous().numpy()})[0]
+    )
+
+
+def benchmark_backends(
+    image_paths,
+    calibration_paths,
+    model,
+    preprocess,
+    backends=BACKENDS,
+    tolerance=1e-1,
+):
+    """
+    Compare inference backends on sample images against eager float32 baseline.
+    Backends are traced, exported and calibrated on separate calibration images,
+    so static_int8 is not scored on the images it was calibrated on.
+
+    Args:
+        image_paths (list): sample of images to run inference on
+        calibration_paths (list): sample of other images used to build the backends
+        model (torch.nn.Module): eager model in eval mode
+        preprocess (torchvision.transforms.Compose): preprocessing of the images
+        backends (tuple): backends to compare
+        tolerance (float): max allowed absolute difference of output logits
+
+    Returns:
+        list: one dict per backend with throughput, logits difference and top-1 agreement
+    """
+    images = load_images(image_paths, preprocess)
+    calibration_images = (
+        load_images(calibration_paths, preprocess) if calibration_paths else None
+    )
+    with torch.no_grad():
+        baseline = model(images)
+
+    report = []
+    for backend in backends:
+        for channels_last in (False, True):
+            if channels_last and backend in ("onnx", "static_int8"):
+                continue
+            name = backend + (" + channels_last" if channels_last else "")
+            if backend in EXAMPLE_INPUT_BACKENDS and calibration_images is None:
+                print(f"{name}: skipped - no images left for calibration")
+                continue
+            try:
+                infer = build_backend(model, backend, calibration_images, channels_last)
+                with torch.no_grad():
+                    infer(images[:1])  # warm up, torch.compile compiles here
+                    start_time = time.time()
+                    outputs = torch.cat(
+                        [infer(img_tensor.unsqueeze(0)) for img_tensor in images]
+                    )
+                    elapsed = time.time() - start_time
+            except Exception as e:
+                print(f"{name}: failed - {e}")
+                continue
+
+            max_abs_diff = (outputs - baseline).abs().max().item()
+            report.append(
+                {
+                    "backend": name,
+                    "images_per_second": len(images) / elapsed,
+                    "max_abs_diff": max_abs_diff,
+                    "top1_agreement": (outputs.argmax(1) == baseline.argmax(1))
+                    .float()
+                    .mean()
+                    .item(),
+                    "within_tolerance": max_abs_diff <= tolerance,
+                }
+            )
+
+    print(f"{'backend':<30}{'img/s':>10}{'max diff':>12}{'top-1':>8}  ok")
+    for row in report:
+        print(
+            f"{row['backend']:<30}{row['images_per_second']:>10.2f}"
+            f"{row['max_abs_diff']:>12.5f}{row['top1_agreement']:>8.3f}"
+            f"  {row['within_tolerance']}"
+        )
+    return report
+
+
+def load_images(image_paths, preprocess):
+    """
+    Load and preprocess images into one batch.
+
+    Args:
+        image_paths (list): paths to images
+        preprocess (torchvision.transforms.Compose): preprocessing of the images
+
+    Returns:
+        torch.Tensor: batch of preprocessed images
+    """
+    return torch.stack(
+        [preprocess(Image.open(path).convert("RGB")) for path in image_paths]
+    )
+
+
+def find_images():
     process_image_queue = []
 
     for root, _, file_names in os.walk(IMAGE_DIR):
@@ -69,8 +293,43 @@ def main():
             ):
                 process_image_queue.append(image_path)
 
+    return process_image_queue
+
+
+def main(backend="eager", channels_last=False, benchmark=0, thumbnail_dir=None):
+    """
+    Do all processing.
+    """
+    # LOAD MODEL
+    model, preprocess = load_model()
+    process_image_queue = find_images()
+
+    if benchmark:
+        # first half is scored, second half is used only for calibration
+        sample = np.random.default_rng(0).choice(
+            process_image_queue,
+            size=min(2 * benchmark, len(process_image_queue)),
+            replace=False,
+        )
+        benchmark_backends(
+            list(sample[:benchmark]), list(sample[benchmark:]), model, preprocess
+        )
+        return
+
+    if process_image_queue:
+        example_inputs = None
+        if backend in EXAMPLE_INPUT_BACKENDS:
+            example_inputs = load_images(process_image_queue[:8], preprocess)
+        model = build_backend(model, backend, example_inputs, channels_last)
+
+    if thumbnail_dir is not None:
+        os.makedirs(thumbnail_dir, exist_ok=True)
+
+    result_dir = {}
     for image in tqdm(process_image_queue):
-        result_dir[os.path.basename(image)] = process_image(image, preprocess, model)
+        result_dir[os.path.basename(image)] = process_image(
+            image, preprocess, model, thumbnail_dir
+        )
 
     # ok, i know it's a bad idea, do not judge me
     with open(OUTPUT, "w", encoding="utf-8") as json_file:
@@ -78,4 +337,24 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--backend", choices=BACKENDS, default="eager")
+    parser.add_argument("--channels-last", action="store_true")
+    parser.add_argument(
+        "--benchmark",
+        type=int,
+        default=0,
+        help="compare all backends on given number of sample images",
+    )
+    parser.add_argument(
+        "--thumbnails",
+        default=None,
+        help="directory to save 150x150 dashboard thumbnails to in the same pass",
+    )
+    arguments = parser.parse_args()
+    main(
+        arguments.backend,
+        arguments.channels_last,
+        arguments.benchmark,
+        arguments.thumbnails,
+    )
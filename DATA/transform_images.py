@@ -7,11 +7,14 @@ import json
 from PIL import Image, ImageOps
 
 
+def pad_image(img, size=(150, 150)):
+    color = (0, 0, 0) if img.mode == "RGB" else 0
+    return ImageOps.pad(img, size, color=color, method=Image.Resampling.LANCZOS)
+
+
 def resize_and_pad_image(input_path, output_path, size=(150, 150)):
     with Image.open(input_path) as img:
-        color = (0, 0, 0) if img.mode == "RGB" else 0
-        img = ImageOps.pad(img, size, color=color, method=Image.Resampling.LANCZOS)
-        img.save(output_path)
+        pad_image(img, size).save(output_path)
 
 
 def process_images(source_folder, output_folder, json_file_path):
@@ -1,4 +1,5 @@
 import os
+import sys
 
 from logging_config import setup_logger
 
@@ -7,6 +8,9 @@ from src.visualisation.plotly_raport import VisualizationApp
 
 
 LOGGER = setup_logger()
+# single parquet file, directory of parquet shards or glob pattern
+DATA_PATH = sys.argv[1] if len(sys.argv) > 1 else "data/output_data.parquet"
+THUMBNAILS_PATH = "data/vis_images.bin"
 
 
 if __name__ == "__main__":
@@ -14,7 +18,7 @@ if __name__ == "__main__":
     LOGGER.info("Starting main.py!")
     LOGGER.info("===================================")
     LOGGER.info(f"Current working directory: '{os.getcwd()}'")
-    data_loader = data_manager("data/output_data.parquet")
+    data_loader = data_manager(DATA_PATH)
     data_loader.load_parquet()
     LOGGER.info("Data loading completed.")
     data_loader.prepare_data()
@@ -29,6 +33,11 @@ if __name__ == "__main__":
         z_col="column_2",
         id_col="image_ID",
         images_dir=os.path.abspath("data/vis_images/"),
+        thumbnails_path=(
+            os.path.abspath(THUMBNAILS_PATH)
+            if os.path.isfile(THUMBNAILS_PATH)
+            else None
+        ),
     )
     viz_app.app.run_server()
     # print(pca_100_3)
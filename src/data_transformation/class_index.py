@@ -0,0 +1,82 @@
+import numpy as np
+import polars as pl
+
+from logging_config import setup_logger
+from src.data_transformation.dim_reduction import save_load_logic
+
+
+LOGGER = setup_logger()
+
+
+@save_load_logic
+def predicted_class_index(data: pl.DataFrame, top_k: int = 5) -> pl.DataFrame:
+    """
+    Precompute compact per image table of predicted classes from the model logits.
+    Result is saved next to dimension reduction results, so class based views
+    don't need to touch 'param_x' columns again.
+
+    Parameters:
+    - data: pl.DataFrame - Prepared data with 'image_ID' and 'param_x' logit columns.
+    - top_k: int - Number of best classes to keep for every image.
+
+    Returns:
+    - pl.DataFrame - 'image_ID', 'class_0'..'class_{top_k-1}' (best first),
+      'confidence_0'..'confidence_{top_k-1}' (softmax probabilities) and 'entropy'.
+    """
+    LOGGER.info("## Predicted class index ##")
+    LOGGER.info(f"Number of best classes to keep: '{top_k}'")
+
+    params = data.drop("image_ID")
+    class_ids = np.array(
+        [int(column.removeprefix("param_")) for column in params.columns]
+    )
+    logits = params.to_numpy().astype(np.float32, copy=False)
+
+    logits = logits - logits.max(axis=1, keepdims=True)
+    probabilities = np.exp(logits)
+    probabilities /= probabilities.sum(axis=1, keepdims=True)
+
+    entropy = -np.sum(
+        probabilities * np.log(np.clip(probabilities, 1e-12, None)), axis=1
+    )
+
+    best = np.argpartition(-probabilities, top_k - 1, axis=1)[:, :top_k]
+    best_probabilities = np.take_along_axis(probabilities, best, axis=1)
+    order = np.argsort(-best_probabilities, axis=1)
+    best = np.take_along_axis(best, order, axis=1)
+    best_probabilities = np.take_along_axis(best_probabilities, order, axis=1)
+
+    class_table = pl.DataFrame(
+        {"image_ID": data["image_ID"]}
+        | {f"class_{x}": class_ids[best[:, x]].astype(np.int16) for x in range(top_k)}
+        | {f"confidence_{x}": best_probabilities[:, x] for x in range(top_k)}
+        | {"entropy": entropy}
+    )
+    LOGGER.info(f"Output data shape: '{class_table.shape}'")
+
+    return class_table
+
+
+def class_inverted_index(
+    class_table: pl.DataFrame, column: str = "class_0"
+) -> dict[int, np.ndarray]:
+    """
+    Build inverted index from predicted class to row indexes of images.
+
+    Args:
+        class_table (pl.DataFrame): Output of `predicted_class_index` (or other per image table).
+        column (str): Column to index, e.g. 'cluster' for clustering results.
+
+    Returns:
+        dict[int, np.ndarray]: Best class -> sorted row indexes of images predicted as this class.
+    """
+    grouped = (
+        class_table.select(column)
+        .with_row_index("row")
+        .group_by(column)
+        .agg(pl.col("row").sort())
+    )
+    return {
+        class_id: np.array(rows, dtype=np.int64)
+        for class_id, rows in zip(grouped[column], grouped["row"])
+    }
@@ -0,0 +1,75 @@
+import numpy as np
+import polars as pl
+from sklearn.cluster import MiniBatchKMeans
+
+from logging_config import setup_logger
+from src.data_transformation.dim_reduction import polar_to_numpy, save_load_logic
+
+
+LOGGER = setup_logger()
+
+
+@save_load_logic
+@polar_to_numpy
+def mini_batch_k_means_clustering(
+    data: np.ndarray,
+    n_clusters: int,
+    standardization: bool = True,
+    pre_pca_components: int = None,
+    random_state: int = 0,
+    dtype: str = "float32",
+) -> dict[str, np.ndarray]:
+    """
+    Cluster images with MiniBatchKMeans on the feature matrix.
+
+    Parameters:
+    - data: np.ndarray - Input data, preprocessed by `polar_to_numpy`.
+    - n_clusters: int - Number of clusters.
+    - standardization: bool - Whether to standardization the data before clustering.
+    - pre_pca_components: int - Project data with PCA (e.g. to 50 components) before clustering.
+    - random_state: int - Random state for reproducibility.
+    - dtype: str - Compute dtype.
+
+    Returns:
+    - dict[str, np.ndarray] - 'cluster' label of every image.
+    """
+    LOGGER.info("## MiniBatchKMeans clustering ##")
+    LOGGER.info(f"Number of clusters: '{n_clusters}'")
+
+    k_means = MiniBatchKMeans(
+        n_clusters=n_clusters, random_state=random_state, n_init="auto"
+    )
+    labels = k_means.fit_predict(data)
+
+    LOGGER.info(f"Output data shape: '{labels.shape}'")
+
+    return {"cluster": labels.astype(np.int32)}
+
+
+def cluster_overview(
+    clusters: pl.DataFrame,
+    coordinates: pl.DataFrame,
+    columns: tuple[str, ...] = ("column_0", "column_1", "column_2"),
+    id_col: str = "image_ID",
+) -> pl.DataFrame:
+    """
+    Aggregate images into cluster glyphs: centroid in reduced coordinates and population.
+
+    Args:
+        clusters (pl.DataFrame): Output of `mini_batch_k_means_clustering`.
+        coordinates (pl.DataFrame): Dimension reduction results.
+        columns (tuple[str, ...]): Coordinate columns.
+        id_col (str): Column with image IDs.
+
+    Returns:
+        pl.DataFrame: 'cluster', mean of coordinate columns and 'population', one row per cluster.
+    """
+    return (
+        coordinates.join(clusters, on=id_col, how="inner")
+        .group_by("cluster")
+        .agg(
+            [pl.col(column).mean() for column in columns]
+            + [pl.len().alias("population")]
+        )
+        .sort("cluster")
+    )
@@ -1,12 +1,21 @@
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatchcase, translate
+from glob import glob
+import hashlib
+import json
 import os
 import time
 
 import polars as pl
 
 from logging_config import setup_logger
+from src.data_transformation.file_lock import atomic_write
 
 
 LOGGER = setup_logger()
+PARAMS_COUNT = 1000
+MANIFEST_FILE_NAME = "manifest.json"
+POLARS_DTYPES = {"float32": pl.Float32, "float64": pl.Float64}
 
 
 class data_manager:
@@ -14,38 +23,242 @@ class data_manager:
     Class to manage data loading and preparation.
 
     Attributes:
-        data_path (str): Path to the data file.
+        data_path (str): Path to the data file, directory of parquet shards or glob pattern.
+        manifest_path (str): Path to the shards manifest.
         DataFrame (pl.DataFrame): Loaded and prepared data.
     """
 
-    def __init__(self, data_path: str):
+    def __init__(
+        self,
+        data_path: str,
+        manifest_path: str = None,
+        max_workers: int = None,
+        dtype: str = "float64",
+    ):
         """
         Initialize the DataManager with the path to the data file.
 
         Args:
-            data_path (str): Path to the data file.
+            data_path (str): Path to the data file, directory of parquet shards or glob pattern.
+            manifest_path (str): Path to the shards manifest. Defaults to 'manifest.json'
+                in data_path when data_path is a directory.
+            max_workers (int): Number of threads used to read shards.
+            dtype (str): dtype of image parameters after preparation, 'float32' or 'float64'.
         """
         LOGGER.info(f"Data manager initialized, input path: '{data_path}'")
 
         self.data_path = os.path.abspath(data_path)
+        if manifest_path is None and os.path.isdir(self.data_path):
+            manifest_path = os.path.join(self.data_path, MANIFEST_FILE_NAME)
+        self.manifest_path = (
+            os.path.abspath(manifest_path) if manifest_path is not None else None
+        )
+        self.max_workers = max_workers
+        self.dtype = dtype
         self.DataFrame = None
+        self.params = list(range(PARAMS_COUNT))
 
-    def load_parquet(self):
+    def find_shards(self) -> list[str]:
         """
-        Load data from a parquet file into a Polars DataFrame.
+        Find parquet files matching data_path. It can be a single file, a directory
+        of parquet shards or a glob pattern.
+
+        Returns:
+            list[str]: Sorted list of paths to parquet shards.
 
         Raises:
-            Exception: If there is an error while loading the parquet file.
+            FileNotFoundError: If no parquet file was found.
         """
         LOGGER.info(f"Checking if '{self.data_path}' exists")
-        if not os.path.exists(self.data_path):
+        if os.path.isdir(self.data_path):
+            shards = glob(os.path.join(self.data_path, "*.parquet"))
+        elif any(char in self.data_path for char in "*?["):
+            shards = glob(self.data_path)
+        elif os.path.exists(self.data_path):
+            shards = [self.data_path]
+        else:
+            shards = []
+
+        if not shards:
             LOGGER.error(f"Path '{self.data_path}' does not exist.")
             raise FileNotFoundError(f"Path '{self.data_path}' does not exist.")
 
+        return sorted(shards)
+
+    def load_manifest(self) -> dict:
+        """
+        Load shards manifest: shard -> first/last image ID, row count and checksum.
+
+        Returns:
+            dict: Manifest content, empty if there is no manifest file yet.
+        """
+        if self.manifest_path is None or not os.path.isfile(self.manifest_path):
+            return {}
+
+        with open(self.manifest_path, "r", encoding="utf-8") as json_file:
+            return json.load(json_file)
+
+    def update_manifest(self) -> dict:
+        """
+        Add shards that are not in the manifest yet. Already described shards are not
+        read again, so adding a new batch costs only the new shard.
+
+        Returns:
+            dict: Updated manifest.
+
+        Raises:
+            ValueError: If data manager has no manifest path.
+        """
+        if self.manifest_path is None:
+            LOGGER.error("No manifest path given.")
+            raise ValueError("No manifest path given.")
+
+        manifest = self.load_manifest()
+        new_shards = [
+            shard
+            for shard in self.find_shards()
+            if self._shard_key(shard) not in manifest
+        ]
+        LOGGER.info(f"Adding {len(new_shards)} new shards to '{self.manifest_path}'")
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for shard, shard_info in zip(
+                new_shards, executor.map(describe_shard, new_shards)
+            ):
+                manifest[self._shard_key(shard)] = shard_info
+
+        with open(self.manifest_path, "w", encoding="utf-8") as json_file:
+            json.dump(manifest, json_file, indent=4)
+
+        return manifest
+
+    def verify_manifest(self) -> list[str]:
+        """
+        Compare checksums of shards with the ones saved in the manifest.
+
+        Returns:
+            list[str]: Shards which are missing or were changed since added to the manifest.
+        """
+        invalid_shards = []
+        for shard_key, shard_info in self.load_manifest().items():
+            shard = os.path.join(os.path.dirname(self.manifest_path), shard_key)
+            if (
+                not os.path.isfile(shard)
+                or file_checksum(shard) != shard_info["checksum"]
+            ):
+                LOGGER.error(f"Shard '{shard_key}' does not match the manifest.")
+                invalid_shards.append(shard_key)
+
+        return invalid_shards
+
+    def scan_shards(
+        self,
+        image_ids: list[str] = None,
+        id_range: tuple[int, int] = None,
+        id_pattern: str = None,
+        params: list[int | str] = None,
+    ) -> list[pl.LazyFrame]:
+        """
+        Lazily scan every shard, see `scan`. Shards which can't contain requested
+        images (according to the manifest) are skipped without opening them.
+
+        Returns:
+            list[pl.LazyFrame]: One lazy frame per shard with the selection applied.
+        """
+        manifest = self.load_manifest()
+        shards = self.find_shards()
+        if id_range is not None:
+            range_rows = self._range_rows(shards, manifest, id_range)
+        seen_ids = set()
+        lazy_frames = []
+
+        for shard in shards:
+            shard_info = manifest.get(self._shard_key(shard))
+
+            rows = None
+            if id_range is not None:
+                rows = range_rows[shard]
+                if not rows:
+                    continue
+
+            if image_ids is not None and shard_info is not None:
+                if not any(
+                    shard_info["first_id"] <= image_id <= shard_info["last_id"]
+                    for image_id in image_ids
+                ):
+                    continue
+
+            lazy_frames.append(
+                self._scan_shard(shard, image_ids, rows, id_pattern, params, seen_ids)
+            )
+
+        return lazy_frames
+
+    def scan(
+        self,
+        image_ids: list[str] = None,
+        id_range: tuple[int, int] = None,
+        id_pattern: str = None,
+        params: list[int | str] = None,
+    ) -> pl.LazyFrame:
+        """
+        Lazily scan the parquet shards, reading only the requested images and parameters.
+
+        Two layouts are supported:
+        - raw layout (output of save_json_as_parquet.py) - one column per image holding
+          a list of parameters. Image selection is done by column projection, parameters
+          are gathered from the list after it is read, so they don't reduce disk reads.
+        - row layout (prepared data or dim reduction results) - one row per image with
+          'image_ID' column. Image selection is pushed down as a predicate / slice.
+
+        All given selectors are combined, so only images matching every one of them are returned.
+        Index range counts images across all shards in order. If the same image ID is
+        in more than one shard, the first one is kept.
+
+        Args:
+            image_ids (list[str]): Image IDs to select.
+            id_range (tuple[int, int]): Image index range to select, [start, end).
+            id_pattern (str): Glob pattern (e.g. '*_0000*.JPEG') matched against image IDs.
+            params (list[int | str]): Parameters to select, as indexes or column names.
+
+        Returns:
+            pl.LazyFrame: Lazy frame with the selection applied.
+        """
+        return combine_shards(self.scan_shards(image_ids, id_range, id_pattern, params))
+
+    def load_parquet(
+        self,
+        image_ids: list[str] = None,
+        id_range: tuple[int, int] = None,
+        id_pattern: str = None,
+        params: list[int | str] = None,
+    ):
+        """
+        Load data from parquet shards into a Polars DataFrame. Shards are read in parallel threads.
+        Optional selectors are the same as in `scan` and limit what is read from the files.
+
+        Raises:
+            FileNotFoundError: If no parquet file was found.
+            Exception: If there is an error while loading the parquet file.
+        """
+        self.find_shards()
+
         try:
-            LOGGER.info(f"Starting to load parquet file from '{self.data_path}'")
+            lazy_frames = self.scan_shards(image_ids, id_range, id_pattern, params)
+            LOGGER.info(
+                f"Starting to load {len(lazy_frames)} parquet shards from '{self.data_path}'"
+            )
             start_time = time.time()
-            self.DataFrame = pl.read_parquet(self.data_path)
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                data_frames = list(
+                    executor.map(lambda lazy_frame: lazy_frame.collect(), lazy_frames)
+                )
+            self.DataFrame = (
+                combine_shards(data_frames) if data_frames else pl.DataFrame()
+            )
+            self.params = (
+                list(range(PARAMS_COUNT)) if params is None else param_indexes(params)
+            )
             LOGGER.info(
                 f"Parquet file loaded successfully. Time taken:  {time.time() - start_time}"
             )
@@ -53,6 +266,121 @@ class data_manager:
         except Exception as e:
             LOGGER.error(f"Error while loading parquet file: {e}", exc_info=True)
 
+    def _shard_key(self, shard: str) -> str:
+        if self.manifest_path is None:
+            return os.path.basename(shard)
+        return os.path.relpath(shard, os.path.dirname(self.manifest_path))
+
+    def _range_rows(
+        self, shards: list[str], manifest: dict, id_range: tuple[int, int]
+    ) -> dict[str, range | list[int]]:
+        """
+        Row positions of images from id_range in every shard. Index range counts images
+        after dropping duplicated image IDs (first one is kept), so IDs of the shards are
+        read unless there is one shard or the manifest shows that shards don't overlap.
+        """
+        start, end = max(id_range[0], 0), id_range[1]
+        if len(shards) == 1:
+            return {shards[0]: range(start, min(end, shard_row_count(shards[0])))}
+
+        shard_infos = [manifest.get(self._shard_key(shard)) for shard in shards]
+        if all(shard_info is not None for shard_info in shard_infos):
+            ordered = sorted(shard_infos, key=lambda shard_info: shard_info["first_id"])
+            if all(
+                previous["last_id"] < following["first_id"]
+                for previous, following in zip(ordered, ordered[1:])
+            ):
+                range_rows = {}
+                offset = 0
+                for shard, shard_info in zip(shards, shard_infos):
+                    range_rows[shard] = range(
+                        max(start - offset, 0),
+                        min(end - offset, shard_info["row_count"]),
+                    )
+                    offset += shard_info["row_count"]
+                return range_rows
+
+        LOGGER.info("Shards can overlap, reading image IDs to resolve index range.")
+        image_ids = pl.concat(
+            [
+                shard_image_ids(shard)
+                .to_frame("image_ID")
+                .with_row_index("row")
+                .with_columns(pl.lit(position).alias("shard"))
+                for position, shard in enumerate(shards)
+            ]
+        )
+        selected = (
+            image_ids.filter(pl.col("image_ID").is_first_distinct())
+            .slice(start, max(end - start, 0))
+            .group_by("shard", maintain_order=True)
+            .agg(pl.col("row"))
+        )
+
+        range_rows = {shard: [] for shard in shards}
+        for position, rows in selected.iter_rows():
+            range_rows[shards[position]] = rows
+        return range_rows
+
+    def _scan_shard(
+        self,
+        shard: str,
+        image_ids: list[str],
+        rows: range | list[int],
+        id_pattern: str,
+        params: list[int | str],
+        seen_ids: set,
+    ) -> pl.LazyFrame:
+        lazy_frame = pl.scan_parquet(shard)
+        columns = lazy_frame.collect_schema().names()
+
+        if "image_ID" in columns:
+            LOGGER.info(f"Scanning '{shard}' in row layout.")
+            if rows is not None and rows[-1] - rows[0] + 1 == len(rows):
+                lazy_frame = lazy_frame.slice(rows[0], len(rows))
+            elif rows is not None:
+                lazy_frame = (
+                    lazy_frame.with_row_index("row")
+                    .filter(pl.col("row").is_in(list(rows)))
+                    .drop("row")
+                )
+            if image_ids is not None:
+                lazy_frame = lazy_frame.filter(pl.col("image_ID").is_in(image_ids))
+            if id_pattern is not None:
+                lazy_frame = lazy_frame.filter(
+                    pl.col("image_ID").str.contains(pattern_regex(id_pattern))
+                )
+            if params is not None:
+                lazy_frame = lazy_frame.select(
+                    ["image_ID"]
+                    + [x if isinstance(x, str) else f"param_{x}" for x in params]
+                )
+            return lazy_frame
+
+        LOGGER.info(f"Scanning '{shard}' in raw layout.")
+        selected = columns
+        if rows is not None:
+            selected = [columns[row] for row in rows]
+        if image_ids is not None:
+            wanted = set(image_ids)
+            selected = [column for column in selected if column in wanted]
+        if id_pattern is not None:
+            selected = [
+                column for column in selected if fnmatchcase(column, id_pattern)
+            ]
+        selected = [column for column in selected if column not in seen_ids]
+        seen_ids.update(selected)
+
+        if params is not None:
+            # list column is read whole, parameters are gathered from it after reading
+            return lazy_frame.select(
+                [
+                    pl.col(column).list.gather(param_indexes(params))
+                    for column in selected
+                ]
+            )
+        return lazy_frame.select(selected)
+
     def prepare_data(self):
         """
         Prepare the loaded data by transposing, renaming columns, and extracting image parameters.
@@ -66,6 +394,14 @@ class data_manager:
 
         LOGGER.info("## Preparing data - DataFrame ##")
         start_time = time.time()
+        if self.DataFrame.width == 0:
+            LOGGER.warning("No images selected, prepared DataFrame is empty.")
+            self.DataFrame = pl.DataFrame(
+                schema={"image_ID": pl.String}
+                | {f"param_{x}": POLARS_DTYPES[self.dtype] for x in self.params}
+            )
+            return
+
         self.DataFrame = self.DataFrame.transpose(
             include_header=True, column_names=["image_params_list"]
         )
@@ -75,14 +411,17 @@ class data_manager:
         )
 
         self.DataFrame = self.DataFrame.lazy().with_columns(
-            pl.col("image_params_list").list.to_array(1000).alias("image_params_array"),
+            pl.col("image_params_list")
+            .cast(pl.List(POLARS_DTYPES[self.dtype]))
+            .list.to_array(len(self.params))
+            .alias("image_params_array"),
         )
         self.DataFrame = self.DataFrame.lazy().drop("image_params_list")
         self.DataFrame = (
             self.DataFrame.lazy()
             .with_columns(
                 pl.col("image_params_array").arr.to_struct(
-                    fields=[f"param_{x}" for x in range(1000)]
+                    fields=[f"param_{x}" for x in self.params]
                 ),
             )
             .unnest("image_params_array")
@@ -98,5 +437,135 @@ class data_manager:
         if file_path is None:
             file_path = self.data_path
 
-        self.DataFrame.write_parquet(file=file_path)
-        LOGGER.info("Saved DataFrame in to: '{file_path}'.")
+        if os.path.isdir(file_path):
+            LOGGER.error(f"Can't save DataFrame to directory '{file_path}'.")
+            raise ValueError(f"Can't save DataFrame to directory '{file_path}'.")
+
+        with atomic_write(file_path) as temp_path:
+            self.DataFrame.write_parquet(file=temp_path)
+        LOGGER.info(f"Saved DataFrame in to: '{file_path}'.")
+
+
+def file_checksum(file_path: str) -> str:
+    """
+    Calculate sha256 checksum of the file.
+
+    Args:
+        file_path (str): Path to the file.
+
+    Returns:
+        str: Hex digest of the file content.
+    """
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def pattern_regex(id_pattern: str) -> str:
+    """
+    Translate glob pattern to anchored regex accepted by Polars. Polars uses Rust regex,
+    which doesn't know the '\\Z' anchor produced by `fnmatch.translate`.
+
+    Args:
+        id_pattern (str): Glob pattern, e.g. '*_0000*.JPEG'.
+
+    Returns:
+        str: Regex matching whole image ID.
+    """
+    regex = translate(id_pattern).removesuffix(r"\Z").removesuffix(r"\z")
+    return rf"\A{regex}\z"
+
+
+def param_indexes(params: list[int | str]) -> list[int]:
+    """
+    Convert parameters given as indexes or 'param_x' column names to indexes.
+    """
+    return [int(str(x).removeprefix("param_")) for x in params]
+
+
+def shard_image_ids(shard: str) -> pl.Series:
+    """
+    Image IDs of the shard in order: column names of raw layout shard (only metadata
+    is read) or 'image_ID' column of row layout shard.
+
+    Args:
+        shard (str): Path to the parquet shard.
+
+    Returns:
+        pl.Series: Image IDs.
+    """
+    lazy_frame = pl.scan_parquet(shard)
+    columns = lazy_frame.collect_schema().names()
+    if "image_ID" in columns:
+        return lazy_frame.select("image_ID").collect()["image_ID"]
+    return pl.Series(columns, dtype=pl.String)
+
+
+def shard_row_count(shard: str) -> int:
+    """
+    Number of images in the shard, read from parquet metadata only.
+
+    Args:
+        shard (str): Path to the parquet shard.
+
+    Returns:
+        int: Number of columns of raw layout shard or rows of row layout shard.
+    """
+    lazy_frame = pl.scan_parquet(shard)
+    columns = lazy_frame.collect_schema().names()
+    if "image_ID" in columns:
+        return lazy_frame.select(pl.len()).collect().item()
+    return len(columns)
+
+
+def describe_shard(shard: str, checksum: bool = True) -> dict:
+    """
+    Describe parquet shard for the manifest. Only metadata and image IDs are read.
+
+    Args:
+        shard (str): Path to the parquet shard.
+        checksum (bool): Whether to calculate the checksum of the shard.
+
+    Returns:
+        dict: first_id, last_id, row_count and checksum of the shard.
+    """
+    image_ids = shard_image_ids(shard)
+
+    return {
+        "first_id": image_ids.min(),
+        "last_id": image_ids.max(),
+        "row_count": image_ids.len(),
+        "checksum": file_checksum(shard) if checksum else None,
+    }
+
+
+def combine_shards(
+    frames: list[pl.DataFrame | pl.LazyFrame],
+) -> pl.DataFrame | pl.LazyFrame:
+    """
+    Combine frames read from separate shards, dropping duplicated image IDs.
+    Raw layout shards are already deduplicated while scanning.
+
+    Args:
+        frames (list[pl.DataFrame | pl.LazyFrame]): Frames, one per shard.
+
+    Returns:
+        pl.DataFrame | pl.LazyFrame: Combined frame.
+    """
+    if not frames:
+        return pl.LazyFrame()
+    if len(frames) == 1:
+        return frames[0]
+
+    if isinstance(frames[0], pl.LazyFrame):
+        columns = frames[0].collect_schema().names()
+    else:
+        columns = frames[0].columns
+
+    if "image_ID" in columns:
+        return pl.concat(frames, how="vertical").unique(
+            subset="image_ID", keep="first", maintain_order=True
+        )
+    return pl.concat(frames, how="horizontal")
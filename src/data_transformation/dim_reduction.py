@@ -1,14 +1,22 @@
 from functools import wraps
+import inspect
 import os
+import time
 
 import polars as pl
 import numpy as np
 from sklearn.decomposition import PCA, TruncatedSVD
 from sklearn.manifold import TSNE
-from sklearn.preprocessing import StandardScaler
+from sklearn.neighbors import NearestNeighbors
 
 from logging_config import setup_logger
 from src.data_transformation.data_manager import data_manager
+from src.data_transformation.file_lock import file_lock
+from src.data_transformation.preprocessing import (
+    PREPROCESSING_SETTINGS,
+    data_fingerprint,
+    preprocess,
+)
 
 
 LOGGER = setup_logger()
@@ -33,15 +41,43 @@ def data_dir_check():
             f"'{DIM_RED_DATA_DIR}' exists in your project. All dimension reduction results will be saved there"
         )
     else:
-        os.mkdir(DIM_RED_DATA_DIR)
+        os.makedirs(DIM_RED_DATA_DIR, exist_ok=True)
         LOGGER.warning(
             f"Program didn't find '{DIM_RED_DATA_DIR}'. New directory will be created and reused in the future!"
         )
 
 
+def load_data_file(data_manager_dim: data_manager) -> bool:
+    """
+    Load saved dimension reduction results if they exist.
+
+    Args:
+        data_manager_dim (data_manager): Data manager with path to the results file.
+
+    Returns:
+        bool: Whether the results were loaded.
+    """
+    if not os.path.isfile(data_manager_dim.data_path):
+        return False
+
+    LOGGER.info("Found ready data file. Try to load it instead to procces new one!")
+    data_manager_dim.load_parquet()
+    if data_manager_dim.DataFrame is None:
+        LOGGER.warning(
+            f"Found existing file '{data_manager_dim.data_path}' but while loading something went wrong"
+        )
+        LOGGER.warning("Program will try to create new data file!")
+        return False
+
+    LOGGER.info("Returning historicall data!")
+    return True
+
+
 def save_load_logic(func):
     """
     Decorator to handle saving and loading of dimension reduction results.
+    Results file is named after the function arguments and fingerprint of the input
+    data, so results are computed again when the data changes (e.g. new shards).
 
     Args:
         func (function): The function to be decorated.
@@ -50,50 +86,77 @@ def save_load_logic(func):
         function: The wrapped function that saves and loads results from a file.
     """
 
+    def cache_file_path(*args, **kwargs) -> str:
+        file_name = func.__name__.split("_dim")[0]
+        if len(args) > 1:
+            file_name = file_name + "_" + "_".join(map(str, args[1:]))
+        for key, value in sorted(kwargs.items()):
+            file_name = file_name + f"_{key}_{value}"
+        if args and isinstance(args[0], pl.DataFrame):
+            file_name = file_name + "_" + data_fingerprint(args[0])[:16]
+        file_name = file_name + ".parquet"
+
+        return os.path.join(DIM_RED_DATA_DIR, file_name)
+
     @wraps(func)
     def wrapper(*args, **kwargs) -> pl.DataFrame:
         data_dir_check()
-        file_name = func.__name__.split("_dim")[0]
-        if len(args) > 2:
-            file_name = file_name + "_" + "_".join(args[1:]) + ".parquet"
-        elif len(args) == 2:
-            file_name = file_name + "_" + str(args[1]) + ".parquet"
-        else:
-            file_name = file_name + ".parquet"
-
-        file_path = os.path.join(DIM_RED_DATA_DIR, file_name)
+        file_path = cache_file_path(*args, **kwargs)
+        file_name = os.path.basename(file_path)
 
         data_manager_dim = data_manager(file_path)
 
         LOGGER.info(f"check if data file - '{file_name}' was already created.")
-        if os.path.isfile(file_path):
-            LOGGER.info(
-                "Found ready data file. Try to load it instead to procces new one!"
-            )
-            try:
-                data_manager_dim.load_parquet()
-                LOGGER.info("Returning historicall data!")
+        if load_data_file(data_manager_dim):
+            return data_manager_dim.DataFrame
 
+        # only one process computes given results, others wait and load them
+        with file_lock(file_path + ".lock"):
+            if load_data_file(data_manager_dim):
                 return data_manager_dim.DataFrame
 
+            data_manager_dim.DataFrame = func(*args, **kwargs)
+
+            data_manager_dim.save_dataframe_to_file(file_path)
+            LOGGER.info(f"Data saved to '{file_path}'")
+        return data_manager_dim.DataFrame
+
+    def scan_cached(
+        *args,
+        image_ids: list[str] = None,
+        id_range: tuple[int, int] = None,
+        id_pattern: str = None,
+        **kwargs,
+    ) -> pl.LazyFrame:
+        """
+        Lazily scan saved dimension reduction results, computing them first if needed.
+        Only the selected rows are read from the file, see `data_manager.scan`.
+        """
+        file_path = cache_file_path(*args, **kwargs)
+        if os.path.isfile(file_path):
+            try:
+                return data_manager(file_path).scan(
+                    image_ids=image_ids, id_range=id_range, id_pattern=id_pattern
+                )
             except Exception as e:
                 LOGGER.warning(
-                    f"Found existing file '{file_name}' but while loading something went wrong: {e}"
+                    f"Found existing file '{file_path}' but while scanning something went wrong: {e}"
                 )
-                LOGGER.warning("Program will try to create new data file!")
-
-        data_manager_dim.DataFrame = func(*args, **kwargs)
 
-        data_manager_dim.save_dataframe_to_file(file_path)
-        LOGGER.info(f"Data saved to '{file_path}'")
-        return data_manager_dim.DataFrame
+        wrapper(*args, **kwargs)
+        return data_manager(file_path).scan(
+            image_ids=image_ids, id_range=id_range, id_pattern=id_pattern
+        )
 
+    wrapper.scan_cached = scan_cached
+    wrapper.cache_file_path = cache_file_path
     return wrapper
 
 
 def polar_to_numpy(func):
     """
-    Decorator function to convert Polars DataFrame to NumPy array after removing 'image_ID' column.
+    Decorator function to convert Polars DataFrame to NumPy array through the shared, cached
+    preprocessing stage. Preprocessing settings are taken from the wrapped function arguments.
 
     Args:
         func (function): The function to be wrapped.
@@ -102,19 +165,24 @@ def polar_to_numpy(func):
         function: The wrapped function with Polars DataFrame converted to NumPy array.
     """
 
+    signature = inspect.signature(func)
+
     @wraps(func)
     def wrapper(data: pl.DataFrame, *args, **kwargs) -> pl.DataFrame:
         try:
-            LOGGER.info("Removing 'image_ID' column")
-            if "image_ID" in data.columns:
-                data_droped = data.drop("image_ID")
-            else:
-                data_droped = data
-
-            LOGGER.info("Converting Polars DataFrame to NumPy array.")
-            data_numpy = data_droped.to_numpy()
+            arguments = signature.bind(data, *args, **kwargs)
+            arguments.apply_defaults()
+
+            arguments.arguments["data"] = preprocess(
+                data,
+                **{
+                    setting: arguments.arguments[setting]
+                    for setting in PREPROCESSING_SETTINGS
+                    if setting in arguments.arguments
+                },
+            )
 
-            func_result = func(data_numpy, *args, **kwargs)
+            func_result = func(*arguments.args, **arguments.kwargs)
 
             LOGGER.info(
                 "Converting NumPy array to Polars DataFrame, adding 'image_ID' column back."
@@ -127,24 +195,22 @@ def polar_to_numpy(func):
     return wrapper
 
 
-def standardization_data(data: np.ndarray) -> np.ndarray:
-    LOGGER.info("data standardization")
-    scaler = StandardScaler()
-    return scaler.fit_transform(data)
-
-
 @save_load_logic
 @polar_to_numpy
 def pca_dim_reduction(
-    data: np.ndarray, n_components: int, standardization: bool = True
+    data: np.ndarray,
+    n_components: int,
+    standardization: bool = True,
+    dtype: str = "float64",
 ) -> np.ndarray:
     """
     Perform PCA dimensionality reduction on the input data.
 
     Parameters:
-    - data: np.ndarray - Input data.
+    - data: np.ndarray - Input data, preprocessed by `polar_to_numpy`.
     - n_components: int - Number of components to keep.
     - standardization: bool - Whether to standardization the data before PCA.
+    - dtype: str - Compute dtype, 'float32' halves memory and speeds up BLAS.
 
     Returns:
     - np.ndarray - Data after PCA dimensionality reduction.
@@ -154,9 +220,6 @@ def pca_dim_reduction(
 
     pca = PCA(n_components=n_components)
 
-    if standardization:
-        data = standardization_data(data)
-
     data_pca = pca.fit_transform(data)
 
     LOGGER.info(f"Output data shape: '{data_pca.shape}'")
@@ -172,17 +235,21 @@ def t_sne_dim_reduction(
     standardization: bool = True,
     perplexity: float = 30.0,
     random_state: int = None,
+    pre_pca_components: int = None,
+    dtype: str = "float64",
 ) -> np.ndarray:
     """
     Perform t-SNE dimensionality reduction on the input data.
 
     Parameters:
-    - data: np.ndarray - Input data.
+    - data: np.ndarray - Input data, preprocessed by `polar_to_numpy`.
     - n_components: int - Number of components to keep.
     - standardization: bool - Whether to standardization the data before t-SNE.
     - perplexity: float - The perplexity parameter.
     - learning_rate: float - The learning rate parameter.
     - random_state: int - Random state for reproducibility.
+    - pre_pca_components: int - Project data with PCA (e.g. to 50 components) before t-SNE.
+    - dtype: str - Compute dtype, 'float32' halves memory and speeds up BLAS.
 
     Returns:
     - np.ndarray - Data after t-SNE dimensionality reduction.
@@ -196,9 +263,6 @@ def t_sne_dim_reduction(
         random_state=random_state,
     )
 
-    if standardization:
-        data = standardization_data(data)
-
     data_t_sne = t_sne.fit_transform(data)
 
     LOGGER.info(f"Output data shape: '{data_t_sne.shape}'")
@@ -214,16 +278,18 @@ def truncated_svd_dim_reduction(
     standardization: bool = False,
     random_state: int = None,
     density_threshold: float = 0.0,
+    dtype: str = "float64",
 ) -> np.ndarray:
     """
     Perform Truncated SVD dimensionality reduction on the input data.
 
     Parameters:
-    - data: np.ndarray - Input data.
+    - data: np.ndarray - Input data, preprocessed by `polar_to_numpy`.
     - n_components: int - Number of components to keep.
     - standardization: bool - Whether to standardization the data before Truncated SVD.
     - random_state: int - Random state for reproducibility.
     - density_threshold: float - Set values to zero when this value smaller than density_threshold.
+    - dtype: str - Compute dtype, 'float32' halves memory and speeds up BLAS.
 
     Returns:
     - np.ndarray - Data after Truncated SVD dimensionality reduction.
@@ -233,17 +299,71 @@ def truncated_svd_dim_reduction(
 
     svd = TruncatedSVD(n_components=n_components, random_state=random_state)
 
-    if density_threshold > 0.0:
-        LOGGER.info(
-            f"Set values to zero when this value smaller than '{density_threshold}'"
-        )
-        data[data < density_threshold] = 0.0
-
-    if standardization:
-        data = standardization_data(data)
-
     data_svd = svd.fit_transform(data)
 
     LOGGER.info(f"Output data shape: '{data_svd.shape}'")
 
     return data_svd
+
+
+def dtype_validation_report(
+    dim_reduction, data: pl.DataFrame, *args, n_neighbors: int = 10, **kwargs
+) -> dict:
+    """
+    Compare dimension reduction computed in float32 with the float64 one.
+    Results are not saved to dimension reduction files, but preprocessed input of both
+    dtypes is saved to 'data/preprocessing' like in regular runs.
+
+    Parameters:
+    - dim_reduction: function - One of dimension reduction functions.
+    - data: pl.DataFrame - Input data.
+    - args, kwargs - Arguments of the dimension reduction function (without dtype).
+    - n_neighbors: int - Number of nearest neighbors compared between both results.
+
+    Returns:
+    - dict - Time taken, output memory, per component absolute correlation and
+      mean fraction of nearest neighbors shared by float32 and float64 results.
+    """
+    LOGGER.info(f"## dtype validation report - {dim_reduction.__name__} ##")
+    compute = dim_reduction.__wrapped__
+    results = {}
+    report = {}
+
+    for dtype in ("float64", "float32"):
+        start_time = time.time()
+        results[dtype] = compute(data, *args, dtype=dtype, **kwargs).drop("image_ID")
+        report[f"time_{dtype}"] = time.time() - start_time
+        report[f"memory_{dtype}"] = results[dtype].estimated_size()
+
+    data_64 = results["float64"].to_numpy()
+    data_32 = results["float32"].to_numpy().astype(np.float64)
+
+    report["abs_correlation"] = [
+        float(abs(np.corrcoef(data_64[:, x], data_32[:, x])[0, 1]))
+        for x in range(data_64.shape[1])
+    ]
+
+    n_neighbors = min(n_neighbors, len(data_64) - 1)
+    neighbors_64 = (
+        NearestNeighbors(n_neighbors=n_neighbors)
+        .fit(data_64)
+        .kneighbors(return_distance=False)
+    )
+    neighbors_32 = (
+        NearestNeighbors(n_neighbors=n_neighbors)
+        .fit(data_32)
+        .kneighbors(return_distance=False)
+    )
+    report["neighbors_overlap"] = float(
+        np.mean(
+            [
+                len(np.intersect1d(row_64, row_32)) / n_neighbors
+                for row_64, row_32 in zip(neighbors_64, neighbors_32)
+            ]
+        )
+    )
+
+    for key, value in report.items():
+        LOGGER.info(f"{key}: {value}")
+
+    return report
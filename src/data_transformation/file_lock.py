@@ -0,0 +1,78 @@
+from contextlib import contextmanager
+import os
+import tempfile
+import time
+
+from logging_config import setup_logger
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+
+LOGGER = setup_logger()
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+@contextmanager
+def file_lock(lock_path: str):
+    """
+    Exclusive lock shared between processes (and threads), based on the lock file.
+    Blocks until the lock is acquired.
+
+    Args:
+        lock_path (str): Path to the lock file, created if it does not exist.
+    """
+    with open(lock_path, "a+b") as lock_file:
+        LOGGER.info(f"Waiting for lock '{lock_path}'")
+        start_time = time.time()
+        lock_file.seek(0)
+        if os.name == "nt":
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        else:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        LOGGER.info(
+            f"Lock '{lock_path}' acquired. Time taken:  {time.time() - start_time}"
+        )
+
+        try:
+            yield
+        finally:
+            lock_file.seek(0)
+            if os.name == "nt":
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+@contextmanager
+def atomic_write(file_path: str):
+    """
+    Yield temporary path next to file_path. When writing to it succeeds, the temporary
+    file is atomically renamed to file_path, so readers never see half-written file.
+    The file gets the same permissions as files created with open(), respecting umask.
+
+    Args:
+        file_path (str): Final path of the file.
+    """
+    file_descriptor, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(file_path)),
+        prefix=os.path.basename(file_path),
+        suffix=".tmp",
+    )
+    os.close(file_descriptor)
+
+    try:
+        yield temp_path
+        os.chmod(temp_path, 0o666 & ~UMASK)
+        os.replace(temp_path, file_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
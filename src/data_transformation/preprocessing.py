@@ -0,0 +1,171 @@
+from collections import OrderedDict
+import hashlib
+import os
+import weakref
+
+import numpy as np
+import polars as pl
+from sklearn.decomposition import PCA
+from sklearn.preprocessing import StandardScaler
+
+from logging_config import setup_logger
+from src.data_transformation.file_lock import atomic_write, file_lock
+
+
+LOGGER = setup_logger()
+PREPROCESSING_DATA_DIR = os.path.abspath(
+    os.path.join(
+        os.path.dirname(os.path.realpath(__file__)), "..", "..", "data", "preprocessing"
+    )
+)
+PREPROCESSING_SETTINGS = (
+    "standardization",
+    "density_threshold",
+    "pre_pca_components",
+    "dtype",
+)
+MEMORY_CACHE_SIZE = 4
+
+_memory_cache = OrderedDict()
+_fingerprints = {}
+
+
+def data_fingerprint(data: pl.DataFrame) -> str:
+    """
+    Calculate fingerprint of the DataFrame content. It is hashed from raw column values,
+    so it doesn't change with Polars version, and computed once per DataFrame object
+    (DataFrames are not modified in place in this project).
+
+    Args:
+        data (pl.DataFrame): Input data.
+
+    Returns:
+        str: Hex digest identifying columns and values of the data.
+    """
+    if id(data) in _fingerprints:
+        return _fingerprints[id(data)]
+
+    sha256 = hashlib.sha256()
+    sha256.update(",".join(data.columns).encode())
+    for column in data.iter_columns():
+        if column.dtype.is_numeric():
+            sha256.update(np.ascontiguousarray(column.to_numpy()))
+        else:
+            sha256.update("\0".join(map(str, column.to_list())).encode())
+    fingerprint = sha256.hexdigest()
+
+    _fingerprints[id(data)] = fingerprint
+    weakref.finalize(data, _fingerprints.pop, id(data), None)
+    return fingerprint
+
+
+def standardization_data(data: np.ndarray) -> np.ndarray:
+    LOGGER.info("data standardization")
+    scaler = StandardScaler()
+    return scaler.fit_transform(data)
+
+
+def preprocess(
+    data: pl.DataFrame,
+    standardization: bool = False,
+    density_threshold: float = 0.0,
+    pre_pca_components: int = None,
+    dtype: str = "float64",
+) -> np.ndarray:
+    """
+    Shared preprocessing stage used by all dimension reduction functions.
+    Drops 'image_ID' column, zeroes values below density_threshold, standardizes data
+    and optionally projects it with PCA. Results are memoized in memory and saved
+    to the file, keyed by the data fingerprint and settings.
+
+    Parameters:
+    - data: pl.DataFrame - Input data.
+    - standardization: bool - Whether to standardize the data.
+    - density_threshold: float - Set values to zero when this value smaller than density_threshold.
+    - pre_pca_components: int - Number of PCA components to project the data on, None to skip.
+    - dtype: str - dtype of the output array, e.g. 'float32'.
+
+    Returns:
+    - np.ndarray - Preprocessed data.
+    """
+    dtype = np.dtype(dtype)
+    settings = (
+        f"{standardization}_{density_threshold}_{pre_pca_components}_{dtype.name}"
+    )
+    # fingerprint is computed once per DataFrame and shared with results file names
+    memory_key = (data_fingerprint(data), settings)
+
+    if memory_key in _memory_cache:
+        LOGGER.info(f"Returning preprocessed data from memory, settings: '{settings}'")
+        _memory_cache.move_to_end(memory_key)
+        return _memory_cache[memory_key]
+
+    cache_key = hashlib.sha256("_".join(memory_key).encode()).hexdigest()[:32]
+    file_path = os.path.join(PREPROCESSING_DATA_DIR, f"{cache_key}.npy")
+    data_numpy = _load_preprocessed(file_path)
+
+    if data_numpy is None:
+        os.makedirs(PREPROCESSING_DATA_DIR, exist_ok=True)
+        # only one process preprocesses given data, others wait and load it
+        with file_lock(file_path + ".lock"):
+            data_numpy = _load_preprocessed(file_path)
+            if data_numpy is None:
+                data_numpy = _preprocess(
+                    data, standardization, density_threshold, pre_pca_components, dtype
+                )
+                with atomic_write(file_path) as temp_path:
+                    with open(temp_path, "wb") as npy_file:
+                        np.save(npy_file, data_numpy)
+                LOGGER.info(f"Preprocessed data saved to '{file_path}'")
+
+    data_numpy.flags.writeable = False
+    _memory_cache[memory_key] = data_numpy
+    if len(_memory_cache) > MEMORY_CACHE_SIZE:
+        _memory_cache.popitem(last=False)
+
+    return data_numpy
+
+
+def _load_preprocessed(file_path: str) -> np.ndarray | None:
+    if not os.path.isfile(file_path):
+        return None
+
+    LOGGER.info(f"Found preprocessed data file '{file_path}'")
+    try:
+        return np.load(file_path)
+    except Exception as e:
+        LOGGER.warning(
+            f"Found existing file '{file_path}' but while loading something went wrong: {e}"
+        )
+        return None
+
+
+def _preprocess(
+    data: pl.DataFrame,
+    standardization: bool,
+    density_threshold: float,
+    pre_pca_components: int,
+    dtype: np.dtype,
+) -> np.ndarray:
+    LOGGER.info("## Preprocessing data ##")
+    LOGGER.info("Removing 'image_ID' column")
+    if "image_ID" in data.columns:
+        data = data.drop("image_ID")
+
+    LOGGER.info(f"Converting Polars DataFrame to NumPy array of '{dtype.name}'.")
+    data_numpy = data.to_numpy().astype(dtype, copy=False)
+
+    if density_threshold > 0.0:
+        LOGGER.info(
+            f"Set values to zero when this value smaller than '{density_threshold}'"
+        )
+        data_numpy[data_numpy < density_threshold] = 0.0
+
+    if standardization:
+        data_numpy = standardization_data(data_numpy)
+
+    if pre_pca_components is not None:
+        LOGGER.info(f"PCA pre-projection to '{pre_pca_components}' components")
+        data_numpy = PCA(n_components=pre_pca_components).fit_transform(data_numpy)
+
+    return data_numpy
@@ -0,0 +1,178 @@
+from io import BytesIO
+import os
+
+from matplotlib.path import Path
+import numpy as np
+import polars as pl
+from sklearn.neighbors import KDTree
+
+from logging_config import setup_logger
+
+
+LOGGER = setup_logger()
+
+_index_cache = {}
+
+
+class spatial_index:
+    """
+    KD-tree over reduced 3D coordinates with radius, box and lasso queries.
+
+    Attributes:
+        DataFrame (pl.DataFrame): Indexed dimension reduction results.
+        points (np.ndarray): Coordinates of the points, one row per image.
+        tree (KDTree): KD-tree built over the points.
+    """
+
+    def __init__(
+        self,
+        data: pl.DataFrame,
+        columns: tuple[str, ...] = ("column_0", "column_1", "column_2"),
+        id_col: str = "image_ID",
+    ):
+        """
+        Build KD-tree over the given coordinate columns.
+
+        Args:
+            data (pl.DataFrame): Dimension reduction results.
+            columns (tuple[str, ...]): Coordinate columns.
+            id_col (str): Column with image IDs.
+        """
+        LOGGER.info(f"Building spatial index over {data.height} points")
+        self.DataFrame = data
+        self.columns = list(columns)
+        self.id_col = id_col
+        self.points = data.select(self.columns).to_numpy()
+        self.tree = KDTree(self.points)
+
+    def radius_query(self, center: list[float], radius: float) -> np.ndarray:
+        """
+        Find points within radius from the center.
+
+        Returns:
+            np.ndarray: Sorted row indexes of found points.
+        """
+        rows = self.tree.query_radius(np.asarray([center], dtype=float), r=radius)[0]
+        return np.sort(rows)
+
+    def point_radius_query(self, image_id: str, radius: float) -> np.ndarray:
+        """
+        Find points within radius from the image with given ID.
+
+        Returns:
+            np.ndarray: Sorted row indexes of found points.
+        """
+        rows = (self.DataFrame[self.id_col] == image_id).arg_true()
+        if rows.is_empty():
+            LOGGER.error(f"Image '{image_id}' is not in the spatial index.")
+            raise ValueError(f"Image '{image_id}' is not in the spatial index.")
+
+        return self.radius_query(self.points[rows[0]], radius)
+
+    def box_query(self, lower: list[float], upper: list[float]) -> np.ndarray:
+        """
+        Find points inside axis aligned box. KD-tree is queried with the sphere
+        around the box, then points are checked against the box bounds.
+
+        Returns:
+            np.ndarray: Sorted row indexes of found points.
+        """
+        lower = np.asarray(lower, dtype=float)
+        upper = np.asarray(upper, dtype=float)
+        rows = self.radius_query((lower + upper) / 2, np.linalg.norm(upper - lower) / 2)
+        inside = np.all(
+            (self.points[rows] >= lower) & (self.points[rows] <= upper), axis=1
+        )
+        return rows[inside]
+
+    def lasso_query(
+        self,
+        polygon: list[tuple[float, float]],
+        axes: tuple[int, int] = (0, 1),
+        depth_range: tuple[float, float] = None,
+    ) -> np.ndarray:
+        """
+        Find points inside lasso polygon drawn on the plane of two axes,
+        optionally limited to a range along the remaining axis.
+
+        Args:
+            polygon (list[tuple[float, float]]): Lasso vertices on the plane of the axes.
+            axes (tuple[int, int]): Indexes of coordinate columns forming the plane.
+            depth_range (tuple[float, float]): Range along the remaining axis, None for all.
+
+        Returns:
+            np.ndarray: Sorted row indexes of found points.
+        """
+        polygon = np.asarray(polygon, dtype=float)
+        lower = self.points.min(axis=0)
+        upper = self.points.max(axis=0)
+        lower[list(axes)] = polygon.min(axis=0)
+        upper[list(axes)] = polygon.max(axis=0)
+        if depth_range is not None:
+            depth_axis = ({0, 1, 2} - set(axes)).pop()
+            lower[depth_axis], upper[depth_axis] = depth_range
+
+        rows = self.box_query(lower, upper)
+        inside = Path(polygon).contains_points(self.points[rows][:, list(axes)])
+        return rows[inside]
+
+    def selection(self, rows: np.ndarray, images_dir: str = None) -> pl.DataFrame:
+        """
+        Get selected points, optionally with paths to their thumbnails.
+
+        Returns:
+            pl.DataFrame: Image IDs, coordinates and 'thumbnail' path when images_dir is given.
+        """
+        selected = self.DataFrame.select([self.id_col] + self.columns)[rows]
+        if images_dir is not None:
+            selected = selected.with_columns(
+                pl.concat_str(
+                    [pl.lit(os.path.join(images_dir, "")), pl.col(self.id_col)]
+                ).alias("thumbnail")
+            )
+        return selected
+
+
+def cached_spatial_index(dim_reduction, *args, **kwargs) -> spatial_index:
+    """
+    Get spatial index over saved dimension reduction results. Index is built once
+    per results file and rebuilt only when the file changes.
+
+    Parameters:
+    - dim_reduction: function - One of dimension reduction functions.
+    - args, kwargs - Arguments of the dimension reduction function.
+
+    Returns:
+    - spatial_index - Index over the dimension reduction results.
+    """
+    file_path = dim_reduction.cache_file_path(*args, **kwargs)
+    if os.path.isfile(file_path) and file_path in _index_cache:
+        modification_time, index = _index_cache[file_path]
+        if modification_time == os.path.getmtime(file_path):
+            return index
+
+    index = spatial_index(dim_reduction(*args, **kwargs))
+    modification_time = os.path.getmtime(file_path)
+    _index_cache[file_path] = (modification_time, index)
+    return index
+
+
+def export_selection(
+    selection: pl.DataFrame, file: str | BytesIO, file_format: str = None
+) -> None:
+    """
+    Save selected points to parquet or CSV file.
+
+    Args:
+        selection (pl.DataFrame): Selected points.
+        file (str | BytesIO): Path or buffer to write to.
+        file_format (str): 'csv' or 'parquet', by default taken from file extension.
+    """
+    if file_format is None:
+        file_format = "csv" if str(file).lower().endswith(".csv") else "parquet"
+
+    if file_format == "csv":
+        selection.write_csv(file)
+    else:
+        selection.write_parquet(file)
+    LOGGER.info(f"Saved selection of {selection.height} points as {file_format}")
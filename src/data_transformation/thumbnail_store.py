@@ -0,0 +1,176 @@
+"""
+Packed thumbnail store - all thumbnails in one data file plus offset/length index
+keyed by image_ID, read through mmap.
+
+Pack thumbnails:
+    uv run -m src.data_transformation.thumbnail_store pack data/vis_images data/vis_images.bin
+
+Unpack thumbnails:
+    uv run -m src.data_transformation.thumbnail_store unpack data/vis_images.bin data/vis_images
+"""
+
+import argparse
+import mmap
+import os
+import time
+
+import polars as pl
+
+from logging_config import setup_logger
+
+
+LOGGER = setup_logger()
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".gif")
+
+
+def index_path(data_path: str) -> str:
+    """
+    Path of the index file belonging to the packed data file.
+    """
+    return os.path.splitext(data_path)[0] + ".index.parquet"
+
+
+class thumbnail_store:
+    """
+    Read only access to packed thumbnails.
+
+    Attributes:
+        data_path (str): Path to the packed data file.
+        index (dict[str, tuple[int, int]]): image_ID -> (offset, length) in the data file.
+    """
+
+    def __init__(self, data_path: str):
+        """
+        Open packed data file and load its index.
+
+        Args:
+            data_path (str): Path to the packed data file.
+        """
+        LOGGER.info(f"Thumbnail store initialized, input path: '{data_path}'")
+        self.data_path = os.path.abspath(data_path)
+
+        if not os.path.isfile(self.data_path):
+            LOGGER.error(f"Path '{self.data_path}' does not exist.")
+            raise FileNotFoundError(f"Path '{self.data_path}' does not exist.")
+
+        index = pl.read_parquet(index_path(self.data_path))
+        self.index = {
+            image_id: (offset, length) for image_id, offset, length in index.iter_rows()
+        }
+
+        self._file = open(self.data_path, "rb")
+        self._mmap = None
+        if os.path.getsize(self.data_path) > 0:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        LOGGER.info(f"Loaded index of {len(self.index)} thumbnails")
+
+    def __contains__(self, image_id: str) -> bool:
+        return image_id in self.index
+
+    def get(self, image_id: str) -> memoryview:
+        """
+        Get encoded thumbnail without copying it.
+
+        Args:
+            image_id (str): ID of the image.
+
+        Returns:
+            memoryview: Encoded image bytes (in the format of the packed file).
+
+        Raises:
+            KeyError: If there is no thumbnail for the image.
+        """
+        offset, length = self.index[image_id]
+        return memoryview(self._mmap)[offset : offset + length]
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+
+def pack_thumbnails(images_dir: str, data_path: str) -> int:
+    """
+    Pack thumbnails from directory into one data file and its index.
+    If the data file already exists, only new images are appended to it.
+
+    Args:
+        images_dir (str): Directory with thumbnail files, file name is used as image_ID.
+        data_path (str): Path to the packed data file.
+
+    Returns:
+        int: Number of packed thumbnails.
+    """
+    start_time = time.time()
+    index = {"image_ID": [], "offset": [], "length": []}
+    if os.path.isfile(data_path) and os.path.isfile(index_path(data_path)):
+        index = pl.read_parquet(index_path(data_path)).to_dict(as_series=False)
+    packed = set(index["image_ID"])
+
+    with open(data_path, "ab") as data_file:
+        offset = data_file.tell()
+        for root, _, files in os.walk(images_dir):
+            for file in sorted(files):
+                if file in packed or not file.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+
+                with open(os.path.join(root, file), "rb") as image_file:
+                    image_bytes = image_file.read()
+                data_file.write(image_bytes)
+
+                index["image_ID"].append(file)
+                index["offset"].append(offset)
+                index["length"].append(len(image_bytes))
+                packed.add(file)
+                offset += len(image_bytes)
+
+    pl.DataFrame(
+        index, schema={"image_ID": pl.String, "offset": pl.Int64, "length": pl.Int64}
+    ).write_parquet(index_path(data_path))
+    LOGGER.info(
+        f"Packed {len(index['image_ID'])} thumbnails into '{data_path}'. Time taken:  {time.time() - start_time}"
+    )
+    return len(index["image_ID"])
+
+
+def unpack_thumbnails(data_path: str, output_dir: str) -> int:
+    """
+    Unpack thumbnails from packed data file into separate files.
+
+    Args:
+        data_path (str): Path to the packed data file.
+        output_dir (str): Directory to write thumbnail files to.
+
+    Returns:
+        int: Number of unpacked thumbnails.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    store = thumbnail_store(data_path)
+    try:
+        for image_id in store.index:
+            with open(os.path.join(output_dir, image_id), "wb") as image_file:
+                image_file.write(store.get(image_id))
+    finally:
+        store.close()
+
+    LOGGER.info(f"Unpacked {len(store.index)} thumbnails into '{output_dir}'")
+    return len(store.index)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    pack_parser = subparsers.add_parser("pack", help="pack directory of thumbnails")
+    pack_parser.add_argument("images_dir")
+    pack_parser.add_argument("data_path")
+
+    unpack_parser = subparsers.add_parser("unpack", help="unpack thumbnails")
+    unpack_parser.add_argument("data_path")
+    unpack_parser.add_argument("output_dir")
+
+    arguments = parser.parse_args()
+    if arguments.command == "pack":
+        pack_thumbnails(arguments.images_dir, arguments.data_path)
+    else:
+        unpack_thumbnails(arguments.data_path, arguments.output_dir)
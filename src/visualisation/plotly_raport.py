@@ -1,18 +1,43 @@
+import base64
+import mimetypes
 import os
+import numpy as np
 import polars as pl
+import plotly.colors
 import plotly.graph_objects as go
 import dash
 from dash import dcc, html, Input, Output, State
 from PIL import Image
 
 from logging_config import setup_logger
+from src.data_transformation.class_index import (
+    class_inverted_index,
+    predicted_class_index,
+)
+from src.data_transformation.clustering import (
+    cluster_overview,
+    mini_batch_k_means_clustering,
+)
 from src.data_transformation.dim_reduction import (
     pca_dim_reduction,
     t_sne_dim_reduction,
     truncated_svd_dim_reduction,
 )
+from src.data_transformation.spatial_index import (
+    cached_spatial_index,
+    export_selection,
+)
+from src.data_transformation.thumbnail_store import thumbnail_store
 
 LOGGER = setup_logger()
+CLASS_COLORS = plotly.colors.qualitative.Light24
+DIM_REDUCTIONS = {
+    "PCA": pca_dim_reduction,
+    "T_sne": t_sne_dim_reduction,
+    "SVD": truncated_svd_dim_reduction,
+}
+MAX_THUMBNAILS = 50
+N_CLUSTERS = 200
 
 
 class VisualizationApp:
@@ -24,43 +49,162 @@ class VisualizationApp:
         z_col: str,
         id_col: str,
         images_dir: str,
+        thumbnails_path: str = None,
     ):
         self.DataFrame = data
-        self.data = pca_dim_reduction(self.DataFrame, 3).head(100)
+        self.class_table = predicted_class_index(self.DataFrame)
+        self.class_rows = class_inverted_index(self.class_table)
+        self.clusters = mini_batch_k_means_clustering(
+            self.DataFrame, min(N_CLUSTERS, self.DataFrame.height)
+        )
+        self.cluster_rows = class_inverted_index(self.clusters, "cluster")
         self.x_col = x_col
         self.y_col = y_col
         self.z_col = z_col
         self.id_col = id_col
         self.images_dir = images_dir
+        self.thumbnails = (
+            thumbnail_store(thumbnails_path) if thumbnails_path is not None else None
+        )
         self.max_data_count = self.DataFrame.height
         self.range_start = 0
         self.range_end = 100
-        self.data_set_name = "PCA top 100"
-        self.fig = self.create_scatter3d_figure()
+        self.class_id = None
+        self.cluster_id = None
+        self.confidence_band = (0.0, 1.0)
+        self.red_method = "PCA"
+        self.view = "clusters"
+        self.clicked_id = None
+        self.selection = None
+        self.data = self.select_clusters(pca_dim_reduction)
+        self.data_set_name = "PCA clusters overview"
+        self.fig = self.create_cluster_figure()
         self.app = self.create_dash_app()
 
-    def update_data(self, new_range: tuple[int, int], red_method: str) -> None:
+    def update_data(
+        self,
+        new_range: tuple[int, int],
+        red_method: str,
+        class_id: int = None,
+        confidence_band: tuple[float, float] = (0.0, 1.0),
+        view: str = "points",
+    ) -> None:
         self.range_start, self.range_end = new_range
-        self.data_set_name = f"{red_method} DATA {self.range_start}-{self.range_end}"
-        if red_method == "PCA":
-            self.data = pca_dim_reduction(self.DataFrame, 3).slice(
-                self.range_start, self.range_end - self.range_start
-            )
-        elif red_method == "T_sne":
-            self.data = t_sne_dim_reduction(self.DataFrame, 3).slice(
-                self.range_start, self.range_end - self.range_start
-            )
-        elif red_method == "SVD":
-            self.data = truncated_svd_dim_reduction(self.DataFrame, 3).slice(
-                self.range_start, self.range_end - self.range_start
+        self.class_id = class_id
+        self.cluster_id = None
+        self.confidence_band = tuple(confidence_band)
+        self.view = view
+        if view == "clusters":
+            self.data_set_name = f"{red_method} clusters overview"
+        elif class_id is None:
+            self.data_set_name = (
+                f"{red_method} DATA {self.range_start}-{self.range_end}"
             )
+        else:
+            self.data_set_name = f"{red_method} DATA class {class_id}"
+        if red_method not in DIM_REDUCTIONS:
+            return
+        self.red_method = red_method
+        dim_reduction = DIM_REDUCTIONS[red_method]
+
+        if view == "clusters":
+            self.data = self.select_clusters(dim_reduction)
+            self.fig = self.create_cluster_figure()
+            return
+
+        self.data = self.select_data(dim_reduction)
 
         self.fig = self.create_scatter3d_figure()
 
+    def expand_cluster(self, cluster_id: int) -> None:
+        """
+        Switch from clusters overview to points of the given cluster.
+        """
+        self.cluster_id = cluster_id
+        self.view = "points"
+        self.data_set_name = f"{self.red_method} DATA cluster {cluster_id}"
+        self.data = self.select_data(DIM_REDUCTIONS[self.red_method])
+        self.fig = self.create_scatter3d_figure()
+
+    def select_clusters(self, dim_reduction) -> pl.DataFrame:
+        """
+        Cluster glyphs covering the whole dataset: centroid in reduced coordinates and population.
+        """
+        coordinates = dim_reduction.scan_cached(self.DataFrame, 3).collect()
+        return cluster_overview(
+            self.clusters,
+            coordinates,
+            columns=(self.x_col, self.y_col, self.z_col),
+            id_col=self.id_col,
+        )
+
+    def select_data(self, dim_reduction) -> pl.DataFrame:
+        """
+        Select points to show using the cluster and predicted class indexes: all images
+        of the expanded cluster and/or selected class, or images from the id range when
+        neither is selected, limited to the confidence band. Only selected rows are read
+        from dimension reduction results.
+        """
+        no_rows = np.array([], dtype=np.int64)
+        rows = None
+        if self.cluster_id is not None:
+            rows = self.cluster_rows.get(self.cluster_id, no_rows)
+        if self.class_id is not None:
+            class_rows = self.class_rows.get(self.class_id, no_rows)
+            rows = class_rows if rows is None else np.intersect1d(rows, class_rows)
+        if rows is None:
+            rows = np.arange(
+                max(self.range_start, 0), min(self.range_end, self.max_data_count)
+            )
+
+        confidence = self.class_table["confidence_0"].to_numpy()[rows]
+        rows = rows[
+            (confidence >= self.confidence_band[0])
+            & (confidence <= self.confidence_band[1])
+        ]
+        class_info = self.class_table.select(self.id_col, "class_0", "confidence_0")[
+            rows
+        ]
+
+        data = dim_reduction.scan_cached(
+            self.DataFrame, 3, image_ids=class_info[self.id_col].to_list()
+        ).collect()
+        return data.join(class_info, on=self.id_col, how="left")
+
+    def thumbnail_element(self, img_id: str, **kwargs) -> html.Img | None:
+        """
+        Image element with the thumbnail, read from packed thumbnail store when available,
+        otherwise from images_dir. Packed thumbnails are sent as they are, without decoding.
+        """
+        if self.thumbnails is not None and img_id in self.thumbnails:
+            mime_type = mimetypes.guess_type(img_id)[0] or "image/jpeg"
+            encoded = base64.b64encode(self.thumbnails.get(img_id)).decode()
+            return html.Img(src=f"data:{mime_type};base64,{encoded}", **kwargs)
+
+        image_path = os.path.join(self.images_dir, img_id)
+        if not os.path.isfile(image_path):
+            LOGGER.warning(f"Thumbnail of '{img_id}' not found.")
+            return None
+        return html.Img(src=Image.open(image_path), **kwargs)
+
+    def point_colors(self) -> list[str]:
+        return [
+            CLASS_COLORS[class_id % len(CLASS_COLORS)]
+            for class_id in self.data["class_0"]
+        ]
+
     def create_scatter3d_figure(self):
         image_paths = [
             os.path.join(self.images_dir, img_id) for img_id in self.data[self.id_col]
         ]
+        hover_texts = [
+            f"{img_id}<br>class: {class_id} ({confidence:.2f})"
+            for img_id, class_id, confidence in zip(
+                self.data[self.id_col],
+                self.data["class_0"],
+                self.data["confidence_0"],
+            )
+        ]
         fig = go.Figure(
             data=[
                 go.Scatter3d(
@@ -68,9 +212,39 @@ class VisualizationApp:
                     y=self.data[self.y_col],
                     z=self.data[self.z_col],
                     mode="markers",
-                    marker=dict(size=5, color="blue"),
+                    marker=dict(size=5, color=self.point_colors()),
                     customdata=image_paths,
-                    text=self.data[self.id_col],
+                    text=hover_texts,
+                    hovertemplate="<b>%{text}</b>",
+                )
+            ]
+        )
+        return fig
+
+    def create_cluster_figure(self):
+        population = self.data["population"].to_numpy()
+        sizes = 5 + 25 * np.sqrt(population / max(population.max(initial=0), 1))
+        hover_texts = [
+            f"cluster {cluster_id}<br>images: {count}"
+            for cluster_id, count in zip(self.data["cluster"], population)
+        ]
+        fig = go.Figure(
+            data=[
+                go.Scatter3d(
+                    x=self.data[self.x_col],
+                    y=self.data[self.y_col],
+                    z=self.data[self.z_col],
+                    mode="markers",
+                    marker=dict(
+                        size=sizes,
+                        color=[
+                            CLASS_COLORS[cluster_id % len(CLASS_COLORS)]
+                            for cluster_id in self.data["cluster"]
+                        ],
+                        opacity=0.7,
+                    ),
+                    customdata=self.data["cluster"],
+                    text=hover_texts,
                     hovertemplate="<b>%{text}</b>",
                 )
             ]
@@ -129,6 +303,41 @@ class VisualizationApp:
                                 "margin-right": "10px",
                             },
                         ),
+                        html.Br(),
+                        html.Label("View:"),
+                        dcc.RadioItems(
+                            id="view-mode",
+                            options=[
+                                {"label": "Clusters overview", "value": "clusters"},
+                                {"label": "Points", "value": "points"},
+                            ],
+                            value=self.view,
+                            labelStyle={
+                                "display": "inline-block",
+                                "margin-right": "10px",
+                            },
+                        ),
+                        html.Br(),
+                        html.Br(),
+                        html.Label("Filter by predicted class (empty for all):"),
+                        dcc.Input(
+                            id="class-filter",
+                            type="number",
+                            min=0,
+                            max=999,
+                            style={"width": "100px"},
+                        ),
+                        html.Br(),
+                        html.Br(),
+                        html.Label("Predicted class confidence:"),
+                        dcc.RangeSlider(
+                            id="confidence-band",
+                            min=0,
+                            max=1,
+                            step=0.05,
+                            value=list(self.confidence_band),
+                            marks={0: "0", 0.5: "0.5", 1: "1"},
+                        ),
                         html.Button("Update", id="update-button", n_clicks=0),
                     ],
                     style={
@@ -146,7 +355,35 @@ class VisualizationApp:
                                 dcc.Graph(id="scatter3d", figure=self.fig),
                                 html.Div(id="output-text"),
                             ],
-                        )
+                        ),
+                        html.Label("Selection radius around clicked point:"),
+                        html.Div(
+                            [
+                                dcc.Input(
+                                    id="selection-radius",
+                                    type="number",
+                                    value=1.0,
+                                    min=0,
+                                    style={"width": "100px"},
+                                ),
+                                html.Button("Select", id="select-button", n_clicks=0),
+                                dcc.RadioItems(
+                                    id="export-format",
+                                    options=[
+                                        {"label": "CSV", "value": "csv"},
+                                        {"label": "Parquet", "value": "parquet"},
+                                    ],
+                                    value="csv",
+                                    inline=True,
+                                ),
+                                html.Button(
+                                    "Export selection", id="export-button", n_clicks=0
+                                ),
+                                dcc.Download(id="selection-download"),
+                            ],
+                            style={"display": "flex", "gap": "7px"},
+                        ),
+                        html.Div(id="selection-output"),
                     ],
                     style={
                         "width": "75%",
@@ -184,11 +421,22 @@ class VisualizationApp:
                 State("range-start", "value"),
                 State("range-end", "value"),
                 State("dimension-reduction-method", "value"),
+                State("class-filter", "value"),
+                State("confidence-band", "value"),
+                State("view-mode", "value"),
                 State("scatter3d", "relayoutData"),
             ],
         )
         def update_figure(
-            n_clicks, clickData, start_value, end_value, method, relayoutData
+            n_clicks,
+            clickData,
+            start_value,
+            end_value,
+            method,
+            class_id,
+            confidence_band,
+            view,
+            relayoutData,
         ):
             ctx = dash.callback_context
 
@@ -198,7 +446,9 @@ class VisualizationApp:
             trigger = ctx.triggered[0]["prop_id"].split(".")[0]
 
             if trigger == "update-button":
-                self.update_data((start_value, end_value), method)
+                self.update_data(
+                    (start_value, end_value), method, class_id, confidence_band, view
+                )
 
                 new_fig = self.fig  # Use the updated figure
 
@@ -225,19 +475,70 @@ class VisualizationApp:
                         self.data_set_name,
                     )
 
+                if self.view == "clusters":
+                    cluster_id = self.data["cluster"][point_index]
+                    self.expand_cluster(cluster_id)
+                    return (
+                        self.fig,
+                        f"Cluster {cluster_id}: {self.data.height} images",
+                        self.data_set_name,
+                    )
+
                 new_fig = self.fig
-                new_marker_colors = ["blue"] * len(self.data)
-                new_marker_colors[point_index] = "red"
+                new_marker_colors = self.point_colors()
+                new_marker_colors[point_index] = "black"
                 new_fig["data"][0]["marker"]["color"] = new_marker_colors
 
                 if relayoutData and "scene.camera" in relayoutData:
                     new_fig.update_layout(scene_camera=relayoutData["scene.camera"])
 
                 point_name = self.data[self.id_col][point_index]
-                image_path = os.path.join(self.images_dir, point_name)
-                LOGGER.info(image_path)
-                image_element = html.Img(src=Image.open(image_path))
+                self.clicked_id = point_name
+                LOGGER.info(point_name)
+                image_element = self.thumbnail_element(point_name)
 
                 return new_fig, image_element, self.data_set_name
 
+        @app.callback(
+            Output("selection-output", "children"),
+            Input("select-button", "n_clicks"),
+            State("selection-radius", "value"),
+        )
+        def select_region(n_clicks, radius):
+            if not n_clicks:
+                raise dash.exceptions.PreventUpdate
+
+            if self.clicked_id is None or radius is None:
+                return "Kliknij punkt na wykresie, aby zaznaczyć obszar wokół niego."
+
+            index = cached_spatial_index(
+                DIM_REDUCTIONS[self.red_method], self.DataFrame, 3
+            )
+            rows = index.point_radius_query(self.clicked_id, radius)
+            self.selection = index.selection(rows, self.images_dir)
+            LOGGER.info(f"Selected {self.selection.height} points around clicked one")
+
+            thumbnails = [
+                self.thumbnail_element(img_id, title=img_id)
+                for img_id in self.selection[self.id_col].head(MAX_THUMBNAILS)
+            ]
+            return [html.Div(f"Selected images: {self.selection.height}")] + [
+                thumbnail for thumbnail in thumbnails if thumbnail is not None
+            ]
+
+        @app.callback(
+            Output("selection-download", "data"),
+            Input("export-button", "n_clicks"),
+            State("export-format", "value"),
+            prevent_initial_call=True,
+        )
+        def export_region(n_clicks, file_format):
+            if self.selection is None:
+                raise dash.exceptions.PreventUpdate
+
+            return dcc.send_bytes(
+                lambda buffer: export_selection(self.selection, buffer, file_format),
+                f"selection.{file_format}",
+            )
+
         return app